@@ -1,151 +1,136 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import io
-import re
-import unicodedata
+import threading
 import zipfile
+from collections import OrderedDict
+from functools import partial
 from pathlib import Path
-from typing import List, Tuple, Set
+from typing import Dict, List, Optional, Tuple
 
 import streamlit as st
 from pypdf import PdfReader, PdfWriter
 
+from classifier import Classification, classify_pages, classify_pages_many, classify_pages_pypdf
+
 # ------------------ Config ------------------
-STRICT_START = True        # solo cabecera (inicio de línea)
-RELAXED_FALLBACK = False   # no escanear toda la página
-CERT_NEAR_WINDOW = 200
-TOP_LINES_K = 10
 SHOW_DEBUG = False
+CLASSIFY_CACHE_ENTRIES = 64  # archivos clasificados que se recuerdan entre re-ejecuciones
 # -------------------------------------------
 
-# Patrones para "INFORME MÉDICO"
-PAT_INFO = r"(?:informe\s+(?:del\s+)?(?:m[eé]dico(?:\s+ocupacional)?|examen\s+m[eé]dico))"
-
-# Variantes frecuentes para "CERTIFICADO DE APTITUD (MÉDICO) (OCUPACIONAL)"
-PAT_CERT_TITLES = [
-    r"certificad[oa]\s+(?:m[eé]dic[ao](?:\s+ocupacional)?\s+)?(?:de\s+)?aptitud(?:\s+m[eé]dic[ao](?:\s+ocupacional)?)?"
-]
-
-# =============== Utilidades de texto ===============
-def normalize_text_hard(s: str) -> str:
-    if not s:
-        return ""
-    s = unicodedata.normalize("NFD", s)
-    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
-    s = re.sub(r"[^a-zA-Z0-9]+", " ", s)
-    s = s.lower().strip()
-    s = re.sub(r"\s+", " ", s)
-    return s
-
-def first_nonempty_lines(text: str, k: int = TOP_LINES_K) -> List[str]:
-    lines = (text or "").splitlines()
-    out = []
-    for ln in lines:
-        n = normalize_text_hard(ln)
-        if n:
-            out.append(n)
-            if len(out) >= k:
-                break
-    return out
-
-def has_title_in_lines(text: str, pattern: str, strict_start: bool) -> bool:
-    lines = first_nonempty_lines(text, k=TOP_LINES_K)
-    # 1) línea por línea
-    for ln in lines:
-        if strict_start:
-            if re.search(rf"^\s*{pattern}\b", ln):
-                return True
-        else:
-            if re.search(pattern, ln):
-                return True
-    # 2) encabezado unido (maneja títulos partidos)
-    head = normalize_text_hard(" ".join(lines))
-    # quitar posibles encabezados previos que suelen ir antes
-    head = re.sub(r"^(examen|periodico|evaluacion|ficha)\s+\w+\s+", "", head)
-    if re.search(pattern, head):
-        return True
-    # 3) tolerar espaciado letra-a-letra: comparar sin espacios
-    head_compact = head.replace(" ", "")
-    pat_compact  = re.sub(r"\s+", "", pattern)
-    return re.search(pat_compact, head_compact) is not None
-
-def has_token_in_top_lines(text: str, token_pat: str, k: int = TOP_LINES_K) -> bool:
-    for ln in first_nonempty_lines(text, k=k):
-        if re.search(token_pat, ln):
-            return True
-    return False
-
-def search_cert_proximity(full_norm: str) -> bool:
-    has_mod = ("medic" in full_norm) or ("ocupacional" in full_norm)
-    if not has_mod:
-        return False
-    for m in re.finditer(r"\bcertificad\w*\b", full_norm):
-        start = m.end()
-        window = full_norm[start:start + CERT_NEAR_WINDOW]
-        if re.search(r"\baptitud\b", window):
-            return True
-    for m in re.finditer(r"\bcertificad\w*\b", full_norm):
-        start = m.end()
-        window = full_norm[start:start + CERT_NEAR_WINDOW]
-        if re.search(r"(medic\w*|ocupacional)", window) and re.search(r"\baptitud\b", window):
-            return True
-    return False
-
-# =============== Detección por página ===============
-def is_cert_page(text: str) -> bool:
-    for pat in PAT_CERT_TITLES:
-        if has_title_in_lines(text, pat, strict_start=STRICT_START):
-            return True
-    if RELAXED_FALLBACK:
-        full = normalize_text_hard(text or "")
-        for pat in PAT_CERT_TITLES:
-            if re.search(pat, full):
-                return True
-        if search_cert_proximity(full):
-            return True
-
-def is_info_page(text: str) -> bool:
-    if has_title_in_lines(text, PAT_INFO, strict_start=STRICT_START):
-        return True
-    if RELAXED_FALLBACK:
-        full = normalize_text_hard(text or "")
-        if re.search(PAT_INFO, full):
-            return True
-    return False
-
-def classify_pages(reader: PdfReader) -> Tuple[Set[int], Set[int], List[str]]:
-    cert_set: Set[int] = set()
-    info_set: Set[int] = set()
-    labels_log: List[str] = []
-
-    for i, page in enumerate(reader.pages):
-        text = page.extract_text() or ""
-        cert = is_cert_page(text)
-        info = False if cert else is_info_page(text)  # prioridad CERT
-
-        if cert:
-            cert_set.add(i); labels_log.append(f"p.{i+1:03d} => CERTIFICADO")
-        elif info:
-            info_set.add(i); labels_log.append(f"p.{i+1:03d} => INFORME")
-        else:
-            labels_log.append(f"p.{i+1:03d} => OTROS")
-
-    overlap = cert_set & info_set
-    if overlap:
-        info_set -= overlap
-        labels_log.append(f"[ajuste] {len(overlap)} págs quitadas de INFORME por solape con CERT.")
-    return cert_set, info_set, labels_log
-
-# =============== Escritura PDFs en memoria ===============
-def write_pdf_to_bytes(reader: PdfReader, idxs: List[int]) -> bytes:
+# =============== Clasificación con caché ===============
+def file_digest(file_bytes: bytes) -> str:
+    return hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+
+# Streamlit re-ejecuta el script en cada interacción (p.ej. al descargar): el texto de las
+# páginas solo se extrae para clasificar, así que se cachea el resultado por hash del archivo.
+# `_file_bytes` lleva "_" para que Streamlit no lo vuelva a hashear; `_precomputed` (tampoco
+# forma parte de la clave) es el resultado ya calculado en lote por `classify_new_files`.
+@st.cache_data(show_spinner=False, max_entries=CLASSIFY_CACHE_ENTRIES)
+def classify_pages_cached(file_hash: str, _file_bytes: bytes,
+                          _precomputed: Optional[Classification] = None) -> Classification:
+    return _precomputed if _precomputed is not None else classify_pages(_file_bytes)
+
+# Respaldo para los PDF en los que PyMuPDF no cuenta las mismas páginas que pypdf (o no los abre):
+# las salidas se escriben con pypdf, así que se clasifica con su texto y su número de páginas.
+@st.cache_data(show_spinner=False, max_entries=CLASSIFY_CACHE_ENTRIES)
+def classify_pages_pypdf_cached(file_hash: str, _file_bytes: bytes) -> Classification:
+    return classify_pages_pypdf(_file_bytes)
+
+# Hashes ya clasificados en este servidor (todas las sesiones y re-ejecuciones): los demás son
+# los que no tienen entrada en la caché de arriba. Acotado como la caché (los más recientes); si
+# aun así la caché descarta una entrada, ese archivo queda fuera del lote y `classify_pages_cached`
+# lo clasifica solo (mismo resultado). Con lock: cada sesión corre en su propio hilo.
+@st.cache_resource(show_spinner=False)
+def classified_hashes() -> Tuple["OrderedDict[str, None]", threading.Lock]:
+    return OrderedDict(), threading.Lock()
+
+def mark_classified(file_hash: str) -> None:
+    done, lock = classified_hashes()
+    with lock:
+        done[file_hash] = None
+        done.move_to_end(file_hash)
+        while len(done) > CLASSIFY_CACHE_ENTRIES:
+            done.popitem(last=False)
+
+# Los archivos aún no clasificados (p.ej. recién subidos) se clasifican juntos para repartir los
+# PDF pequeños entre procesos. En re-ejecuciones y en otras sesiones con los mismos PDF no hay nada.
+def classify_new_files(files: List[Tuple[str, bytes]]) -> Dict[str, Classification]:
+    done, lock = classified_hashes()
+    with lock:
+        new = {h: b for h, b in files if h not in done}
+    if len(new) < 2:
+        return {}
+    # los que fallan (p.ej. un PDF dañado) quedan fuera: se clasifican (y reportan) por separado
+    return {h: res for h, res in zip(new, classify_pages_many(list(new.values()))) if res is not None}
+
+# El reader de pypdf (para copiar páginas) también se conserva entre re-ejecuciones, junto con
+# su lock: las descargas diferidas corren en otros hilos y un PdfReader no admite lecturas
+# concurrentes (dos clics seguidos, o un botón mientras se arma el ZIP, lo romperían).
+PdfSource = Tuple[PdfReader, threading.Lock]
+
+def get_reader(file_hash: str, file_bytes: bytes) -> PdfSource:
+    readers = st.session_state.setdefault("pdf_readers", {})
+    if file_hash not in readers:
+        readers[file_hash] = (PdfReader(io.BytesIO(file_bytes)), threading.Lock())
+    return readers[file_hash]
+
+# =============== Escritura PDFs ===============
+def write_pdf_to_bytes(src: PdfSource, idxs: List[int], file_bytes: bytes) -> bytes:
     if not idxs:
         return b""
-    w = PdfWriter()
-    for i in idxs:
-        w.add_page(reader.pages[i])
-    bio = io.BytesIO()
-    w.write(bio)
-    bio.seek(0)
-    return bio.read()
+    reader, lock = src
+    with lock:  # también len(reader.pages): la primera vez lee el árbol de páginas del stream
+        # todas las páginas en el orden original (p.ej. PDF escaneado = solo historia): es el mismo PDF
+        if idxs == list(range(len(reader.pages))):
+            return file_bytes
+        w = PdfWriter()
+        # una sola llamada con todas las páginas sobre el reader ya parseado (sin reabrir el PDF)
+        w.append(reader, pages=idxs, import_outline=False)
+        bio = io.BytesIO()
+        w.write(bio)
+    return bio.getvalue()
+
+# (carpeta, reader + lock, [(nombre, páginas)], bytes originales, log de detección)
+ZipJob = Tuple[str, PdfSource, List[Tuple[str, List[int]]], bytes, List[str]]
+
+def write_zip_to_bytes(jobs: List[ZipJob]) -> bytes:
+    # ZIP maestro con todos los resultados de todos los PDFs. ZIP_STORED: los PDF ya van comprimidos.
+    # Secuencial a propósito: pypdf es Python puro (no suelta el GIL ni recomprime) y
+    # con hilos + un reader por hilo la escritura resultó ~2x más lenta.
+    zip_master_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_master_buffer, "w", zipfile.ZIP_STORED) as zip_master:
+        for base, src, outputs, file_bytes, labels_log in jobs:
+            # un PDF a la vez, escrito en su entrada apenas se genera: solo hay una salida en
+            # memoria y, si una falla, no queda a medio escribir (va a error.txt y se sigue)
+            errors: List[str] = []
+            for name, idxs in outputs:
+                if not idxs:
+                    continue
+                try:
+                    data = write_pdf_to_bytes(src, idxs, file_bytes)
+                except Exception as e:
+                    errors.append(f"❌ {base}/{name}.pdf: {e}\n")
+                    continue
+                zip_master.writestr(f"{base}/{name}.pdf", data)
+                del data
+            if errors:
+                zip_master.writestr(f"{base}/error.txt", "".join(errors))
+            if SHOW_DEBUG:
+                # el log sí es texto plano: se comprime solo esta entrada
+                zip_master.writestr(f"{base}/debug_deteccion.txt", "\n".join(labels_log),
+                                    compress_type=zipfile.ZIP_DEFLATED)
+    return zip_master_buffer.getvalue()
+
+def download_pdf(src: PdfSource, idxs: List[int], file_bytes: bytes,
+                 errors: Dict[str, str], file_name: str) -> bytes:
+    # las descargas diferidas corren fuera del script (ahí st.error no se muestra): el fallo se
+    # guarda y el panel del archivo lo muestra en la siguiente ejecución
+    try:
+        return write_pdf_to_bytes(src, idxs, file_bytes)
+    except Exception as e:
+        errors[file_name] = str(e)
+        raise
 
 # =============== UI Streamlit ===============
 st.set_page_config(page_title="Clasificar PDF Médico", page_icon="🩺", layout="centered")
@@ -156,73 +141,100 @@ st.caption("Sube uno o varios PDF y genera los documentos clasificados para desc
 uploaded_files = st.file_uploader("Adjunta uno o varios PDF", type=["pdf"], accept_multiple_files=True)
 
 if uploaded_files:
-    # ZIP maestro con todos los resultados de todos los PDFs
-    zip_master_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_master_buffer, "w", zipfile.ZIP_DEFLATED) as zip_master:
-
-        for idx, uploaded in enumerate(uploaded_files, start=1):
-            try:
-                file_bytes = uploaded.read()
-                reader = PdfReader(io.BytesIO(file_bytes))
+    uploads = []
+    for uploaded in uploaded_files:
+        file_bytes = uploaded.getvalue()  # no depende de la posición del archivo
+        uploads.append((uploaded, file_bytes, file_digest(file_bytes)))
+    precomputed = classify_new_files([(file_hash, file_bytes) for _, file_bytes, file_hash in uploads])
+    # 1) procesar todos los archivos; la UI se dibuja después, en un solo bloque
+    results: List[Tuple[str, Optional[ZipJob], str]] = []  # (nombre, resultado, error)
+    for uploaded, file_bytes, file_hash in uploads:
+        try:
+            src = get_reader(file_hash, file_bytes)
+            reader, lock = src
+            with lock:  # la primera vez lee el árbol de páginas (una descarga diferida puede usar el reader)
                 total = len(reader.pages)
 
-                cert_set, info_set, labels_log = classify_pages(reader)
-                all_set = set(range(total))
-                hist_set = all_set - cert_set - info_set
-
-                cert = sorted(cert_set)
-                info = sorted(info_set)
-                hist = sorted(hist_set)
-
-                pdf_cert   = write_pdf_to_bytes(reader, cert)
-                pdf_info   = write_pdf_to_bytes(reader, info)
-                pdf_hist   = write_pdf_to_bytes(reader, hist)
-                pdf_legajo = write_pdf_to_bytes(reader, cert + info + hist)
-
-                # Panel por archivo
-                with st.expander(f"📄 {uploaded.name} — págs: {total} (Cert:{len(cert)} / Inf:{len(info)} / Hist:{len(hist)})", expanded=True):
-                    col1, col2, col3, col4 = st.columns(4)
-                    col1.metric("Certificado", len(cert))
-                    col2.metric("Informe", len(info))
-                    col3.metric("Historia", len(hist))
-                    col4.metric("Total", total)
-
-                    c1, c2 = st.columns(2)
-                    with c1:
-                        st.download_button("📄 Certificado", data=pdf_cert,
-                                           file_name=f"{Path(uploaded.name).stem}_certificado.pdf",
-                                           mime="application/pdf", disabled=(not pdf_cert), key=f"cert_{idx}")
-                        st.download_button("📄 Historia Clínica", data=pdf_hist,
-                                           file_name=f"{Path(uploaded.name).stem}_historia.pdf",
-                                           mime="application/pdf", disabled=(not pdf_hist), key=f"hist_{idx}")
-                    with c2:
-                        st.download_button("📄 Informe Médico", data=pdf_info,
-                                           file_name=f"{Path(uploaded.name).stem}_informe.pdf",
-                                           mime="application/pdf", disabled=(not pdf_info), key=f"info_{idx}")
-                        st.download_button("📦 Legajo (ordenado)", data=pdf_legajo,
-                                           file_name=f"{Path(uploaded.name).stem}_legajo.pdf",
-                                           mime="application/pdf", disabled=(not pdf_legajo), key=f"legajo_{idx}")
-
-                # Agregar resultados de este archivo al ZIP maestro (en su carpeta)
-                base = Path(uploaded.name).stem
-                if pdf_cert:   zip_master.writestr(f"{base}/certificado.pdf", pdf_cert)
-                if pdf_info:   zip_master.writestr(f"{base}/informe.pdf", pdf_info)
-                if pdf_hist:   zip_master.writestr(f"{base}/historia.pdf", pdf_hist)
-                if pdf_legajo: zip_master.writestr(f"{base}/legajo.pdf", pdf_legajo)
-                if SHOW_DEBUG:
-                    zip_master.writestr(f"{base}/debug_deteccion.txt", "\n".join(labels_log))
-
-            except Exception as e:
-                st.error(f"❌ {uploaded.name}: {e}")
-
-    # Botón para descargar TODO junto
-    zip_master_buffer.seek(0)
+            try:
+                cert, info, labels_log, n_pages = classify_pages_cached(file_hash, file_bytes,
+                                                                        precomputed.get(file_hash))
+                mark_classified(file_hash)
+            except Exception:
+                # PyMuPDF no pudo leerlo (las caídas del pool de procesos ya se repiten en serie
+                # con PyMuPDF dentro de classify_pages): se intenta con pypdf
+                n_pages = -1
+            # historia sale de `total`: la clasificación tiene que haber visto las mismas páginas
+            if n_pages != total:
+                cert, info, labels_log, n_pages = classify_pages_pypdf_cached(file_hash, file_bytes)
+            classified = set(cert).union(info)
+            hist = [i for i in range(total) if i not in classified]
+            legajo = cert + info + hist
+
+            # resultados de este archivo (también para el ZIP maestro, en su carpeta)
+            outputs = [("certificado", cert), ("informe", info), ("historia", hist), ("legajo", legajo)]
+            results.append((uploaded.name, (Path(uploaded.name).stem, src, outputs, file_bytes, labels_log), ""))
+
+        except Exception as e:
+            results.append((uploaded.name, None, str(e)))
+
+    # 2) panel por archivo
+    for idx, (name, job, error) in enumerate(results, start=1):
+        if job is None:
+            st.error(f"❌ {name}: {error}")
+            continue
+        base, src, outputs, file_bytes, _ = job
+        pages = dict(outputs)
+        cert, info, hist, legajo = pages["certificado"], pages["informe"], pages["historia"], pages["legajo"]
+
+        # Las descargas individuales se generan al hacer clic (no se guardan 4 PDFs en memoria)
+        download_errors = st.session_state.setdefault("download_errors", {})
+        names = {k: f"{base}_{k}.pdf" for k in pages}
+        pdf_cert   = partial(download_pdf, src, cert, file_bytes, download_errors, names["certificado"])
+        pdf_info   = partial(download_pdf, src, info, file_bytes, download_errors, names["informe"])
+        pdf_hist   = partial(download_pdf, src, hist, file_bytes, download_errors, names["historia"])
+        pdf_legajo = partial(download_pdf, src, legajo, file_bytes, download_errors, names["legajo"])
+
+        total = len(legajo)  # legajo tiene todas las páginas
+        with st.expander(f"📄 {name} — págs: {total} (Cert:{len(cert)} / Inf:{len(info)} / Hist:{len(hist)})", expanded=True):
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Certificado", len(cert))
+            col2.metric("Informe", len(info))
+            col3.metric("Historia", len(hist))
+            col4.metric("Total", total)
+
+            c1, c2 = st.columns(2)
+            with c1:
+                st.download_button("📄 Certificado", data=pdf_cert,
+                                   file_name=names["certificado"],
+                                   mime="application/pdf", disabled=(not cert), key=f"cert_{idx}")
+                st.download_button("📄 Historia Clínica", data=pdf_hist,
+                                   file_name=names["historia"],
+                                   mime="application/pdf", disabled=(not hist), key=f"hist_{idx}")
+            with c2:
+                st.download_button("📄 Informe Médico", data=pdf_info,
+                                   file_name=names["informe"],
+                                   mime="application/pdf", disabled=(not info), key=f"info_{idx}")
+                st.download_button("📦 Legajo (ordenado)", data=pdf_legajo,
+                                   file_name=names["legajo"],
+                                   mime="application/pdf", disabled=(not legajo), key=f"legajo_{idx}")
+            for file_name in names.values():
+                if file_name in download_errors:
+                    st.error(f"❌ {file_name}: {download_errors.pop(file_name)}")
+
+    # Botón para descargar TODO junto (el ZIP también se genera al hacer clic)
     st.download_button("🗜️ Descargar TODO (todos los PDFs) .zip",
-                       data=zip_master_buffer.getvalue(),
+                       data=partial(write_zip_to_bytes, [job for _, job, _ in results if job]),
                        file_name="clasificados_todos.zip",
                        mime="application/zip")
 else:
     st.caption("Formatos soportados: .pdf — El procesamiento ocurre en memoria (sin guardar archivos en disco).")
+
+# soltar los readers de archivos que ya no están subidos (también si se quitaron todos)
+current_hashes = {file_hash for _, _, file_hash in uploads} if uploaded_files else set()
+readers = st.session_state.get("pdf_readers", {})
+for h in list(readers):
+    if h not in current_hashes:
+        del readers[h]
 # =============== FOOTER ===============
 st.markdown("---")
 st.markdown(
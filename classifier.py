@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+# Clasificación de páginas, sin dependencias de Streamlit. El módulo pasa `mypy` y puede
+# compilarse con `mypyc classifier.py` (el .so generado tiene prioridad al importar:
+# recompilar o borrarlo tras editar este archivo).
+import io
+import multiprocessing
+import os
+import re
+import threading
+import unicodedata
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar, Union
+
+import pymupdf
+from pypdf import PdfReader
+
+# ------------------ Config ------------------
+STRICT_START = True        # solo cabecera (inicio de línea)
+RELAXED_FALLBACK = False   # no escanear toda la página
+CERT_NEAR_WINDOW = 200
+TOP_LINES_K = 10
+PARALLEL_MIN_PAGES = 20    # por debajo, el pool de procesos no compensa
+PAGES_PER_TASK = 10        # bloque mínimo de páginas por tarea (amortiza IPC)
+# -------------------------------------------
+
+# Patrones para "INFORME MÉDICO"
+PAT_INFO = r"(?:informe\s+(?:del\s+)?(?:m[eé]dico(?:\s+ocupacional)?|examen\s+m[eé]dico))"
+
+# Variantes frecuentes para "CERTIFICADO DE APTITUD (MÉDICO) (OCUPACIONAL)"
+PAT_CERT_TITLES = [
+    r"certificad[oa]\s+(?:m[eé]dic[ao](?:\s+ocupacional)?\s+)?(?:de\s+)?aptitud(?:\s+m[eé]dic[ao](?:\s+ocupacional)?)?"
+]
+
+# Patrones precompilados (una sola pasada por cadena en vez de una por variante)
+CERT_RE = re.compile("|".join(f"(?:{p})" for p in PAT_CERT_TITLES))
+INFO_RE = re.compile(PAT_INFO)
+# Conjunto CERT + INFO: una sola pasada indica qué títulos aparecen (grupo = clase)
+TITLE_SET_RE = re.compile(rf"(?P<cert>{CERT_RE.pattern})|(?P<info>{INFO_RE.pattern})")
+TITLE_SET_START_RE = re.compile(rf"^\s*(?:{TITLE_SET_RE.pattern})\b")
+# Todo título CERT contiene "certificad" y todo INFO "informe": prefiltro por subcadena
+CERT_KEYWORD = "certificad"
+INFO_KEYWORD = "informe"
+# ... y empieza por ella: prefiltro del título al inicio de línea (líneas ya normalizadas)
+TITLE_PREFIXES = (CERT_KEYWORD, INFO_KEYWORD)
+
+HEAD_PREFIX_RE = re.compile(r"^(examen|periodico|evaluacion|ficha)\s+\w+\s+")
+NON_ALNUM_RE = re.compile(r"[^a-zA-Z0-9]+")
+
+# =============== Utilidades de texto ===============
+def fold_text_nfd(s: str) -> str:
+    s = unicodedata.normalize("NFD", s)
+    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+    s = NON_ALNUM_RE.sub(" ", s)
+    return s.lower()
+
+# Tabla para str.translate: latín (hasta U+02FF) y puntuación general ya plegados
+# (sin tildes, minúsculas, no alfanumérico -> espacio). Evita NFD en el caso común.
+FOLD_TABLE = {cp: fold_text_nfd(chr(cp)) for cp in [*range(0x300), *range(0x2000, 0x2070)]}
+# Misma tabla para texto ASCII, como bytes: bytes.translate es más rápido que str.translate
+ASCII_FOLD_TABLE = bytes(ord(FOLD_TABLE[b]) for b in range(0x80)) + b" " * 0x80
+
+def normalize_text_hard(s: str) -> str:
+    if not s:
+        return ""
+    if s.isascii():
+        # caso más común (cabeceras sin tildes)
+        return " ".join(s.encode("ascii").translate(ASCII_FOLD_TABLE).decode("ascii").split())
+    folded = s.translate(FOLD_TABLE)
+    if not folded.isascii():
+        # hay caracteres fuera de la tabla: camino completo con NFD
+        folded = fold_text_nfd(s)
+    return " ".join(folded.split())
+
+def first_nonempty_lines(text: str, k: int = TOP_LINES_K) -> List[str]:
+    # normaliza línea a línea y corta en k: más barato que plegar la página entera
+    out: List[str] = []
+    for ln in (text or "").splitlines():
+        n = normalize_text_hard(ln)
+        if n:
+            out.append(n)
+            if len(out) >= k:
+                break
+    return out
+
+def match_title_set(title_set_re: "re.Pattern[str]", s: str) -> Set[str]:
+    return {m.lastgroup for m in title_set_re.finditer(s) if m.lastgroup}
+
+def match_titles(top_lines: List[str], strict_start: bool) -> Set[str]:
+    """Clases de título ("cert", "info") presentes en la cabecera de la página."""
+    found: Set[str] = set()
+    # 0) prefiltro: sin palabra clave en la cabecera no hay título
+    head = " ".join(top_lines)
+    if CERT_KEYWORD not in head and INFO_KEYWORD not in head:
+        return found
+    # 1) línea por línea
+    for ln in top_lines:
+        if strict_start:
+            if ln.startswith(TITLE_PREFIXES):
+                m = TITLE_SET_START_RE.search(ln)
+                if m and m.lastgroup:
+                    found.add(m.lastgroup)
+        else:
+            found |= match_title_set(TITLE_SET_RE, ln)
+        if "cert" in found:
+            return found  # CERT tiene prioridad: no hace falta seguir
+    # 2) encabezado unido (maneja títulos partidos); las líneas ya vienen normalizadas
+    # quitar posibles encabezados previos que suelen ir antes
+    head = HEAD_PREFIX_RE.sub("", head)
+    found |= match_title_set(TITLE_SET_RE, head)
+    return found
+
+def search_cert_proximity(full_norm: str) -> bool:
+    has_mod = ("medic" in full_norm) or ("ocupacional" in full_norm)
+    if not has_mod:
+        return False
+    # str.find en lugar de finditer; "aptitud" cerca basta (la variante con medic/ocupacional
+    # era un caso particular)
+    pos = full_norm.find(CERT_KEYWORD)
+    while pos >= 0:
+        end = full_norm.find(" ", pos)
+        if end < 0:
+            end = len(full_norm)
+        # texto normalizado: inicio de palabra == precedido de espacio (como \bcertificad\w*\b)
+        if pos == 0 or full_norm[pos - 1] == " ":
+            window = full_norm[end:end + CERT_NEAR_WINDOW]
+            # palabra completa == rodeada de espacios (o bordes de la ventana)
+            if " aptitud " in f" {window} ":
+                return True
+        pos = full_norm.find(CERT_KEYWORD, end)
+    return False
+
+# (índices CERT, índices INFO, log de etiquetas, total de páginas clasificadas)
+Classification = Tuple[List[int], List[int], List[str], int]
+
+# =============== Detección por página ===============
+# En modo relajado la página completa ya contiene la cabecera: `titles` llega vacío y basta
+# con buscar en `full_norm`. En modo estricto `full_norm` llega vacío.
+def is_cert_page(full_norm: str, titles: Set[str]) -> bool:
+    if "cert" in titles:
+        return True
+    if not RELAXED_FALLBACK or CERT_KEYWORD not in full_norm:
+        return False
+    return CERT_RE.search(full_norm) is not None or search_cert_proximity(full_norm)
+
+def is_info_page(full_norm: str, titles: Set[str]) -> bool:
+    if "info" in titles:
+        return True
+    if not RELAXED_FALLBACK or INFO_KEYWORD not in full_norm:
+        return False
+    return INFO_RE.search(full_norm) is not None
+
+def open_text_doc(file_bytes: bytes) -> pymupdf.Document:
+    # PyMuPDF solo para extraer texto (mucho más rápido que pypdf); la escritura sigue con pypdf
+    return pymupdf.open(stream=file_bytes, filetype="pdf")
+
+def page_text(doc: pymupdf.Document, i: int) -> str:
+    page = doc.load_page(i)
+    # sin fuentes (p.ej. página escaneada) no puede haber texto: se evita extraerlo
+    return (page.get_text("text") or "") if page.get_fonts() else ""
+
+def classify_texts(texts: Iterable[Tuple[int, str]]) -> Tuple[List[int], List[int], List[str]]:
+    cert_ids: List[int] = []
+    info_ids: List[int] = []
+    labels_log: List[str] = []
+
+    for i, text in texts:
+        # normalizar una sola vez por página: el texto completo (relajado) o solo la cabecera
+        if RELAXED_FALLBACK:
+            full_norm, titles = normalize_text_hard(text), set()
+        else:
+            full_norm, titles = "", match_titles(first_nonempty_lines(text), strict_start=STRICT_START)
+        cert = is_cert_page(full_norm, titles)
+        info = False if cert else is_info_page(full_norm, titles)  # prioridad CERT
+
+        if cert:
+            cert_ids.append(i); labels_log.append(f"p.{i+1:03d} => CERTIFICADO")
+        elif info:
+            info_ids.append(i); labels_log.append(f"p.{i+1:03d} => INFORME")
+        else:
+            labels_log.append(f"p.{i+1:03d} => OTROS")
+    return cert_ids, info_ids, labels_log
+
+def classify_page_range(doc: pymupdf.Document, start: int, end: int) -> Tuple[List[int], List[int], List[str]]:
+    return classify_texts((i, page_text(doc, i)) for i in range(start, end))
+
+# =============== Clasificación en paralelo ===============
+# Streamlit corre el script en hilos: `fork` desde un proceso con hilos puede colgarse, así que
+# los workers salen de un forkserver (o de spawn donde no existe, p.ej. Windows)
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+# Con forkserver/spawn cada worker re-importa el script principal (en Streamlit, app.py) al
+# arrancar: un solo pool por proceso, creado al primer uso y compartido entre sesiones, para
+# pagar ese arranque una vez y no en cada clasificación.
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=_MP_CONTEXT)
+        return _pool
+
+def _drop_pool(broken: ProcessPoolExecutor) -> None:
+    # un worker caído deja el pool inservible: el siguiente uso crea otro. Solo se descarta el pool
+    # que falló: si otra sesión ya creó uno nuevo, sus tareas no se cancelan.
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+R = TypeVar("R")
+
+def _run_in_pool(fn: Callable[..., R], tasks: List[Tuple[Any, ...]]) -> List[Union[R, Exception]]:
+    """fn(*task) para cada tarea en el pool compartido: el resultado o la excepción de cada una.
+    Las tareas perdidas con el pool (un worker caído, quizá por el PDF de otra sesión) se repiten
+    aquí en serie: mismo extractor (PyMuPDF) y, por tanto, las mismas etiquetas."""
+    pool = _get_pool()
+    results: Dict[int, Union[R, Exception]] = {}
+    futures: List[Tuple[int, "Future[R]"]] = []
+    lost: List[int] = []
+    for k, task in enumerate(tasks):
+        try:
+            futures.append((k, pool.submit(fn, *task)))
+        except (BrokenProcessPool, RuntimeError):  # roto, o ya cerrado por otra sesión
+            lost.append(k)
+    for k, fut in futures:
+        try:
+            results[k] = fut.result()
+        except (BrokenProcessPool, CancelledError):
+            lost.append(k)
+        except Exception as e:
+            results[k] = e
+    if lost:
+        _drop_pool(pool)
+    for k in lost:
+        try:
+            results[k] = fn(*tasks[k])
+        except Exception as e:
+            results[k] = e
+    return [results[k] for k in range(len(tasks))]
+
+def _classify_range(file_bytes: bytes, start: int, end: int) -> Tuple[List[int], List[int], List[str]]:
+    with open_text_doc(file_bytes) as doc:
+        return classify_page_range(doc, start, end)
+
+def _classify_file(file_bytes: bytes) -> Classification:
+    with open_text_doc(file_bytes) as doc:
+        return (*classify_page_range(doc, 0, doc.page_count), doc.page_count)
+
+def _get_max_workers(n_tasks: int) -> int:
+    return max(1, min(os.cpu_count() or 1, n_tasks))
+
+def classify_pages(file_bytes: bytes) -> Classification:
+    """Índices de páginas CERT e INFO (en orden ascendente), el log de etiquetas y el total de
+    páginas según PyMuPDF (puede no coincidir con pypdf en un PDF con el árbol de páginas dañado)."""
+    with open_text_doc(file_bytes) as doc:
+        total = doc.page_count
+        n_workers = _get_max_workers(len(range(0, total, PAGES_PER_TASK)))
+        if total < PARALLEL_MIN_PAGES or n_workers == 1:
+            results = [classify_page_range(doc, 0, total)]
+        else:
+            # cada tarea lleva el PDF completo: un bloque por worker (de al menos PAGES_PER_TASK)
+            size = max(PAGES_PER_TASK, -(-total // n_workers))
+            starts = range(0, total, size)
+            ends = [min(s + size, total) for s in starts]
+            parts = _run_in_pool(_classify_range, [(file_bytes, s, e) for s, e in zip(starts, ends)])
+            results = []
+            for part in parts:
+                if isinstance(part, Exception):
+                    raise part
+                results.append(part)
+
+    # los rangos llegan en orden, así que concatenar ya deja las listas ordenadas
+    # invariante: cert e info son disjuntas por construcción (una página CERT no se evalúa
+    # como INFO), por eso no hay ajuste de solapes
+    cert: List[int] = []
+    info: List[int] = []
+    labels_log: List[str] = []
+    for cert_ids, info_ids, labels in results:
+        cert.extend(cert_ids)
+        info.extend(info_ids)
+        labels_log.extend(labels)
+    return cert, info, labels_log, total
+
+def classify_pages_pypdf(file_bytes: bytes) -> Classification:
+    """classify_pages extrayendo el texto con pypdf (más lento, sin recorte de cabecera): para los
+    PDF en los que PyMuPDF y pypdf no cuentan las mismas páginas, que se escriben con pypdf."""
+    reader = PdfReader(io.BytesIO(file_bytes))
+    cert, info, labels_log = classify_texts((i, page.extract_text() or "") for i, page in enumerate(reader.pages))
+    return cert, info, labels_log, len(reader.pages)
+
+def _try_classify(fn: Callable[[bytes], Classification], file_bytes: bytes) -> Optional[Classification]:
+    try:
+        return fn(file_bytes)
+    except Exception:
+        return None
+
+def classify_pages_many(files: List[bytes]) -> List[Optional[Classification]]:
+    """classify_pages para varios PDF (mismo orden). Los PDF pequeños van un archivo por tarea.
+    Un archivo que no se puede abrir o clasificar queda en None sin afectar a los demás."""
+    results: Dict[int, Optional[Classification]] = {}
+    small: List[int] = []
+    small_pages = 0
+    for k, file_bytes in enumerate(files):
+        try:
+            with open_text_doc(file_bytes) as doc:
+                n_pages = doc.page_count
+        except Exception:
+            results[k] = None
+            continue
+        if n_pages < PARALLEL_MIN_PAGES:
+            small.append(k)
+            small_pages += n_pages
+        else:
+            results[k] = _try_classify(classify_pages, file_bytes)  # ya reparte sus páginas entre procesos
+    if small_pages < PARALLEL_MIN_PAGES or _get_max_workers(len(small)) == 1:
+        for k in small:
+            results[k] = _try_classify(_classify_file, files[k])
+    else:
+        # una tarea por archivo: el fallo de uno no descarta los resultados de los demás
+        for k, res in zip(small, _run_in_pool(_classify_file, [(files[k],) for k in small])):
+            results[k] = None if isinstance(res, Exception) else res
+    return [results[k] for k in range(len(files))]
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# Equivalencia con la versión original (regex + NFD, antes en app.py): las reescrituras de
+# classifier.py (tabla de plegado, str.find, prefiltros) tienen que dar el mismo resultado.
+# Ejecutar con `python -m pytest test_classifier.py`.
+import random
+import re
+import unicodedata
+from typing import List
+
+import pytest
+
+import classifier
+
+# =============== Referencia (versión original) ===============
+def ref_normalize_text_hard(s: str) -> str:
+    if not s:
+        return ""
+    s = unicodedata.normalize("NFD", s)
+    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+    s = re.sub(r"[^a-zA-Z0-9]+", " ", s)
+    s = s.lower().strip()
+    s = re.sub(r"\s+", " ", s)
+    return s
+
+def ref_first_nonempty_lines(text: str, k: int = classifier.TOP_LINES_K) -> List[str]:
+    out = []
+    for ln in (text or "").splitlines():
+        n = ref_normalize_text_hard(ln)
+        if n:
+            out.append(n)
+            if len(out) >= k:
+                break
+    return out
+
+def ref_has_title_in_lines(text: str, pattern: str, strict_start: bool) -> bool:
+    lines = ref_first_nonempty_lines(text)
+    for ln in lines:
+        if strict_start:
+            if re.search(rf"^\s*{pattern}\b", ln):
+                return True
+        else:
+            if re.search(pattern, ln):
+                return True
+    head = ref_normalize_text_hard(" ".join(lines))
+    head = re.sub(r"^(examen|periodico|evaluacion|ficha)\s+\w+\s+", "", head)
+    if re.search(pattern, head):
+        return True
+    head_compact = head.replace(" ", "")
+    pat_compact = re.sub(r"\s+", "", pattern)
+    return re.search(pat_compact, head_compact) is not None
+
+def ref_search_cert_proximity(full_norm: str) -> bool:
+    has_mod = ("medic" in full_norm) or ("ocupacional" in full_norm)
+    if not has_mod:
+        return False
+    for m in re.finditer(r"\bcertificad\w*\b", full_norm):
+        window = full_norm[m.end():m.end() + classifier.CERT_NEAR_WINDOW]
+        if re.search(r"\baptitud\b", window):
+            return True
+    for m in re.finditer(r"\bcertificad\w*\b", full_norm):
+        window = full_norm[m.end():m.end() + classifier.CERT_NEAR_WINDOW]
+        if re.search(r"(medic\w*|ocupacional)", window) and re.search(r"\baptitud\b", window):
+            return True
+    return False
+
+def ref_is_cert_page(text: str, strict_start: bool, relaxed: bool) -> bool:
+    for pat in classifier.PAT_CERT_TITLES:
+        if ref_has_title_in_lines(text, pat, strict_start):
+            return True
+    if relaxed:
+        full = ref_normalize_text_hard(text or "")
+        for pat in classifier.PAT_CERT_TITLES:
+            if re.search(pat, full):
+                return True
+        if ref_search_cert_proximity(full):
+            return True
+    return False
+
+def ref_is_info_page(text: str, strict_start: bool, relaxed: bool) -> bool:
+    if ref_has_title_in_lines(text, classifier.PAT_INFO, strict_start):
+        return True
+    if relaxed:
+        full = ref_normalize_text_hard(text or "")
+        if re.search(classifier.PAT_INFO, full):
+            return True
+    return False
+
+# =============== Generador de páginas ===============
+WORDS = [
+    "certificado", "CERTIFICADO", "certificada", "certificados", "Certificación", "aptitud",
+    "APTITUD", "aptitudes", "médico", "MÉDICA", "medico", "médicos", "ocupacional", "OCUPACIONAL",
+    "de", "del", "informe", "INFORME", "informes", "examen", "EXAMEN", "periódico", "evaluación",
+    "ficha", "anual", "paciente", "clínica", "fecha", "Ñandú", "n°", "12/03/2024", "-", ":", "·",
+    "c e r t i f i c a d o", "ﬁcha", "café", "é", "Ⅻ", "²", "İ", "ß", "–", " ", "\t",
+]
+
+def random_page(rng: random.Random) -> str:
+    lines = []
+    for _ in range(rng.randint(0, 14)):
+        words = [rng.choice(WORDS) if rng.random() < 0.9 else chr(rng.randint(0, 0x2FFF))
+                 for _ in range(rng.randint(0, 8))]
+        lines.append(rng.choice([" ", "  ", "\t", ""]).join(words))
+    return rng.choice(["\n", "\r\n"]).join(lines)
+
+# =============== Tests ===============
+def test_normalize_every_codepoint():
+    for cp in range(0x20000):
+        ch = chr(cp)
+        if 0xD800 <= cp <= 0xDFFF:
+            continue  # sustitutos sueltos: no llegan como texto extraído
+        assert classifier.normalize_text_hard(f"a{ch}b") == ref_normalize_text_hard(f"a{ch}b"), hex(cp)
+
+def test_normalize_random_pages():
+    rng = random.Random(0)
+    for _ in range(2000):
+        page = random_page(rng)
+        assert classifier.normalize_text_hard(page) == ref_normalize_text_hard(page), page
+        assert classifier.first_nonempty_lines(page) == ref_first_nonempty_lines(page), page
+
+def test_search_cert_proximity():
+    rng = random.Random(1)
+    for _ in range(5000):
+        full_norm = ref_normalize_text_hard(random_page(rng))
+        assert classifier.search_cert_proximity(full_norm) == ref_search_cert_proximity(full_norm), full_norm
+
+@pytest.mark.parametrize("strict_start", [True, False])
+@pytest.mark.parametrize("relaxed", [True, False])
+def test_classify_matches_reference(monkeypatch, strict_start, relaxed):
+    monkeypatch.setattr(classifier, "STRICT_START", strict_start)
+    monkeypatch.setattr(classifier, "RELAXED_FALLBACK", relaxed)
+    rng = random.Random(2)
+    pages = [random_page(rng) for _ in range(5000)]
+    cert_ids, info_ids, _ = classifier.classify_texts(enumerate(pages))
+    cert, info = set(cert_ids), set(info_ids)
+    for i, page in enumerate(pages):
+        ref_cert = ref_is_cert_page(page, strict_start, relaxed)
+        ref_info = not ref_cert and ref_is_info_page(page, strict_start, relaxed)
+        assert (i in cert, i in info) == (ref_cert, ref_info), page